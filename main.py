@@ -1,34 +1,51 @@
 import configparser
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timezone, time
 from zoneinfo import ZoneInfo
-import calendar
-import json
 from shareplum import Site
 from shareplum import Office365
 from shareplum.site import Version
 import pandas as pd
 import io
 import smtplib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from email.message import EmailMessage
 import logging
 import schedule
+import time as _time
 
 logger = logging.getLogger(__name__)
 
-def get_site_status(config): 
-    url = config['DEFAULT']['VerkadaURL']    
+SESSION = requests.Session()
+SESSION.headers.update({"accept": "application/json"})
+SESSION.mount('https://', HTTPAdapter(pool_maxsize=4))
+
+def get_site_status(config):
+    url = config['DEFAULT']['VerkadaURL']
 
     headers = {
-        "accept": "application/json",
         "x-api-key": config['DEFAULT']['VerkadaAPIKey']
     }
 
-    response = requests.get(url, headers=headers)
-    return json.loads(response.text)["sites"]
+    response = SESSION.get(url, headers=headers, timeout=10)
+    return response.json()["sites"]
     
 
+_SCHEDULE_TTL = 21600  # refresh the store schedule every 6 hours
+_schedule_cache = {'data': None, 'ts': 0.0}
+
+def _parse_time_column(column):
+    parsed = pd.to_datetime(column, format="%I:%M %p", errors='coerce').dt.time
+    return [cell if type(cell) is time else (None if pd.isna(value) else value)
+            for cell, value in zip(column, parsed)]
+
+
 def get_schedule_file(config):
+    if _schedule_cache['data'] is not None and _time.time() - _schedule_cache['ts'] < _SCHEDULE_TTL:
+        return _schedule_cache['data']
+
     authcookie = Office365('https://mywirelessgroup.sharepoint.com', 
                            username=config['DEFAULT']['BotUsername'], 
                            password=config['DEFAULT']['BotPassword']).GetCookies()
@@ -38,148 +55,175 @@ def get_schedule_file(config):
 
     schedule_file = folder.get_file('Store Schedules.xlsx')
 
-    df = pd.read_excel(io.BytesIO(schedule_file))
-
-    return df[df['End Date'].isnull()]
-
-
-def market_to_timezone(marketname):
-    match marketname:
-        case "AZPHX Market": 
-            return 'US/Arizona' 
-        case "CABAY Market": 
-            return 'US/Pacific'
-        case "CAGLA Market": 
-            return 'US/Pacific'
-        case "CASAN Market": 
-            return 'US/Pacific'
-        case "CODEN Market":
-            return 'US/Mountain'
-        case "ILCHI Market": 
-            return 'US/Central'
-        case "MIDET Market": 
-            return 'US/Eastern'
-        case "ININD Market": 
-            return 'US/Eastern'
-        case "NVLAS Market": 
-            return 'US/Pacific'
-        case "ORPTL Market": 
-            return 'US/Pacific'
-        case "WASEA Market": 
-            return 'US/Pacific'
-        case _: 
-            return ''
-        
-
-def get_cinglepointid(sitename):
-    try: 
-        cpid = int(sitename.split('~')[1].strip())
-    except IndexError: 
-        cpid = -1
-    except ValueError: 
-        cpid = -1
-    return cpid
-
-
-def get_open_close_columns(validation_day):
-    match validation_day: 
-        case "Monday": 
-            return 4, 5
-        case "Tuesday": 
-            return 6, 7
-        case "Wednesday": 
-            return 8, 9
-        case "Thursday": 
-            return 10, 11
-        case "Friday": 
-            return 12, 13
-        case "Saturday": 
-            return 14, 15
-        case "Sunday": 
-            return 16, 17 
-
-
-def send_alert_email(subject, message, config): 
+    df = pd.read_excel(io.BytesIO(schedule_file), usecols='A:S', engine='openpyxl',
+                       dtype={'Cinglepoint ID': 'Int64'})
+
+    df = df[df['End Date'].isnull()]
+
+    day_times = {
+        day: (_parse_time_column(df.iloc[:, open_column]),
+              _parse_time_column(df.iloc[:, close_column]))
+        for day, (open_column, close_column) in _DAY_COLS.items()
+    }
+
+    schedule_by_cpid = {}
+    for i, cpid_value in enumerate(df['Cinglepoint ID']):
+        if pd.isna(cpid_value):
+            continue
+        hours = {day: (opens[i], closes[i])
+                 for day, (opens, closes) in day_times.items()}
+        schedule_by_cpid[int(cpid_value)] = (df.iat[i, 0], hours)
+
+    _schedule_cache['data'] = schedule_by_cpid
+    _schedule_cache['ts'] = _time.time()
+
+    return schedule_by_cpid
+
+
+_MARKET_TZ = {
+    "AZPHX Market": ZoneInfo('US/Arizona'),
+    "CABAY Market": ZoneInfo('US/Pacific'),
+    "CAGLA Market": ZoneInfo('US/Pacific'),
+    "CASAN Market": ZoneInfo('US/Pacific'),
+    "CODEN Market": ZoneInfo('US/Mountain'),
+    "ILCHI Market": ZoneInfo('US/Central'),
+    "MIDET Market": ZoneInfo('US/Eastern'),
+    "ININD Market": ZoneInfo('US/Eastern'),
+    "NVLAS Market": ZoneInfo('US/Pacific'),
+    "ORPTL Market": ZoneInfo('US/Pacific'),
+    "WASEA Market": ZoneInfo('US/Pacific'),
+}
+
+
+
+_DAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+_DAY_COLS = {
+    "Monday": (4, 5),
+    "Tuesday": (6, 7),
+    "Wednesday": (8, 9),
+    "Thursday": (10, 11),
+    "Friday": (12, 13),
+    "Saturday": (14, 15),
+    "Sunday": (16, 17),
+}
+
+
+@contextmanager
+def smtp_session(config):
+    mailserver = smtplib.SMTP('smtp.office365.com',587)
+    try:
+        mailserver.ehlo()
+        mailserver.starttls()
+        mailserver.login(config["DEFAULT"]["BotUsername"], config["DEFAULT"]["BotPassword"])
+        yield mailserver
+    finally:
+        try:
+            mailserver.quit()
+        except smtplib.SMTPException:
+            mailserver.close()
+
+
+def send_alert_email(subject, message, config, mailserver):
     msg = EmailMessage()
     msg['Subject'] = subject
     msg['From'] = config["DEFAULT"]["BotUsername"]
     msg['To'] = config["DEFAULT"]["AlertRecipient"]
     msg.set_content(message)
 
-
-    mailserver = smtplib.SMTP('smtp.office365.com',587)
-    mailserver.ehlo()
-    mailserver.starttls()
-    mailserver.login(config["DEFAULT"]["BotUsername"], config["DEFAULT"]["BotPassword"])
     mailserver.send_message(msg)
-    mailserver.quit()
 
-    logger.info(f'Alert sent with subject {subject}')
+    logger.info('Alert sent with subject %s', subject)
 
 
-def site_validation(verkadafile, schedulefile, validation_time, validation_day):
+def send_alert_batch(messages, config):
+    with smtp_session(config) as mailserver:
+        for subject, message in messages:
+            send_alert_email(subject, message, config, mailserver)
+
+
+def site_validation(verkadafile, schedulefile, validation_time, validation_day, config):
     skipped_locations = []
-    for site in verkadafile:
-        cpid = get_cinglepointid(site["site_name"])
+    alerts = []
+
+    local_times = {market: validation_time.astimezone(tz).time()
+                   for market, tz in _MARKET_TZ.items()}
+
+    names = pd.Series([site["site_name"] for site in verkadafile])
+    cpids = pd.to_numeric(names.str.split('~').str[1].str.strip(),
+                          errors='coerce').fillna(-1).astype(int).tolist()
+
+    for site, cpid in zip(verkadafile, cpids):
+        site_state = site["site_state"]
+
+        if site_state != 'armed':
+            continue
+
+        site_name = site["site_name"]
 
         if cpid == -1:
-            skipped_locations.append(site["site_name"])
+            skipped_locations.append(site_name)
             continue
 
-        site_state = site["site_state"]
+        siterow = schedulefile.get(cpid)
+
+        if siterow is None:
+            logger.debug("%s skipped for missing schedule row.", site_name)
+            skipped_locations.append(site_name)
+            continue
 
-        siterow = schedulefile[schedulefile['Cinglepoint ID'] == cpid]
-        market_name = siterow.iat[0,0]
-        site_timezone = market_to_timezone(market_name)
+        market_name, site_hours = siterow
+        site_local_time = local_times.get(market_name)
 
-        if site_timezone == '':
-            logger.info(f"{site["site_name"]} skipped for invalid timezone.")
-            skipped_locations.append(site["site_name"])
+        if site_local_time is None:
+            logger.debug("%s skipped for invalid timezone.", site_name)
+            skipped_locations.append(site_name)
             continue
 
-        open_column, close_column = get_open_close_columns(validation_day)
-        
-        open_time = ''
-        close_time = ''
-        try: 
-            open_time = datetime.strptime(siterow.iat[0, open_column], "%I:%M %p").time()
-            close_time = datetime.strptime(siterow.iat[0,close_column], "%I:%M %p").time()
-        except ValueError:
-            logger.info(f"{site["site_name"]} skipped for open/close time.")
-            skipped_locations.append(site["site_name"]) 
+        open_time, close_time = site_hours[validation_day]
+
+        if open_time is None or close_time is None:
+            logger.debug("%s skipped for open/close time.", site_name)
+            skipped_locations.append(site_name)
             continue
-        except TypeError:
-            if not isinstance (open_time, time):
-                open_time = siterow.iat[0, open_column]
-            if not isinstance (close_time, time):
-                close_time = siterow.iat[0, close_column]
-        
-        site_local_time = validation_time.astimezone(ZoneInfo(site_timezone)).time()
-
-        if site_local_time > open_time and site_local_time < close_time and site_state == 'armed':
-            logger.info(f"Closed store alert sent for {site["site_name"]}.")
-            msg_subject = f'Closed store alert for {site["site_name"]}'
-            msg_content = f'''{site["site_name"]} has an open time of {open_time} and a close time of {close_time} on {validation_day} 
-            in the {site_timezone} timezone. 
-            The system time is {validation_time.time()} and site time is {site_local_time}. The alarm state is {site_state}. 
+
+        if open_time < site_local_time < close_time:
+            logger.info("Closed store alert queued for %s.", site_name)
+            msg_subject = f'Closed store alert for {site_name}'
+            msg_content = f'''{site_name} has an open time of {open_time} and a close time of {close_time} on {validation_day}
+            in the {_MARKET_TZ[market_name]} timezone.
+            The system time is {validation_time.time()} and site time is {site_local_time}. The alarm state is {site_state}.
             The alarm state will be checked again in 15 minutes.'''
-            
-            send_alert_email(msg_subject, msg_content, config)
-    
-    logger.warning(f'The following sites were skipped: {skipped_locations}')    
+
+            alerts.append((msg_subject, msg_content))
+
+    if alerts:
+        workers = min(4, len(alerts))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(send_alert_batch, alerts[i::workers], config)
+                       for i in range(workers)]
+            for future in futures:
+                try:
+                    future.result()
+                except Exception:
+                    logger.exception('Alert batch failed to send')
+
+    if skipped_locations:
+        logger.warning('The following sites were skipped: %s', skipped_locations)
     
 
-def validate(schedule_file, config):
+def validate(config):
     # Get current time
     my_time = datetime.now(ZoneInfo('US/Pacific'))
     # Get weekday
-    my_weekday = calendar.day_name[datetime.now().weekday()]
-    
-    logger.info(f"Time is {my_time} Pacific. Day of week is {my_weekday}")
+    my_weekday = _DAYS[my_time.weekday()]
+
+    logger.info("Time is %s Pacific. Day of week is %s", my_time, my_weekday)
 
+    schedule_file = get_schedule_file(config)
     site_list = get_site_status(config)
 
-    site_validation(site_list, schedule_file, my_time, my_weekday)
+    site_validation(site_list, schedule_file, my_time, my_weekday, config)
 
 
 if __name__ == "__main__":
@@ -189,12 +233,11 @@ if __name__ == "__main__":
     logging.basicConfig(format='%(asctime)s %(message)s', filename='verkadaalerts.log', level=logging.INFO)
 
     logger.info("Program started.")
-    
-    schedule_file = get_schedule_file(config)
 
-    validate(schedule_file, config)
-    
-    schedule.every(15).minutes.do(validate, schedule_file=schedule_file, config=config)
+    validate(config)
+
+    schedule.every(15).minutes.do(validate, config=config)
 
     while datetime.now().time() < time(22, 0):
         schedule.run_pending()
+        _time.sleep(min(30, schedule.idle_seconds() or 30))